@@ -1,18 +1,64 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import plotly.express as px
+import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import requests
+import shutil
+
+# Columns used by the cleaning pipeline and the dashboard
+TAXI_COLUMNS = ["tpep_pickup_datetime", "tpep_dropoff_datetime", "PULocationID",
+                "DOLocationID", "fare_amount", "trip_distance", "payment_type"]
+
+# Row filters pushed down into the parquet reader so invalid row groups are skipped
+TAXI_FILTERS = [("trip_distance", ">", 0), ("fare_amount", ">", 0), ("fare_amount", "<=", 500)]
+
+# Weekday names in pandas dayofweek order, used to label the heatmap
+WEEKDAY_ORDER = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Version of the app's cleaned data cache, bump it whenever the cached columns or their order change
+CLEAN_CACHE_VERSION = "1"
+
+# Labels for the payment type codes
+payment_labels = {
+    1: "Credit Card",
+    2: "Cash",
+    3: "No Charge",
+    4: "Dispute",
+    0: "Unknown"
+}
 
 def download_file(url, path):
     if path.exists():
         return
      
+    # Download to a temporary file first so an interrupted download never leaves a partial file
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
     with requests.get(url, stream=True, timeout=30) as r:
         r.raise_for_status()
-        with open(path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+        r.raw.decode_content = True
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=1024 * 1024)
+    tmp_path.replace(path)
+
+def read_taxi_sample(path, n, seed=42):
+    # Scan only the needed columns with the row filters pushed down
+    dataset = ds.dataset(path, format="parquet")
+    table = dataset.to_table(columns=TAXI_COLUMNS, filter=pq.filters_to_expression(TAXI_FILTERS))
+
+    # Sample rows on the Arrow table so only the kept rows are converted to pandas
+    if table.num_rows > n:
+        rng = np.random.default_rng(seed)
+        indices = np.sort(rng.choice(table.num_rows, size=n, replace=False))
+        table = table.take(indices)
+
+    # Convert column by column, releasing Arrow buffers as they are converted
+    return table.to_pandas(split_blocks=True, self_destruct=True)
 
 def clean_data(df):
     # Define critical columns
@@ -22,35 +68,59 @@ def clean_data(df):
     # Drop rows with missing values in critical columns
     df = df.dropna(subset=critical_columns)
 
-    # Filter out invalid trips
-    df = df[
-    (df["trip_distance"] > 0) &
-    (df["fare_amount"] > 0) &
-    (df["fare_amount"] <= 500) &
-    (df["tpep_dropoff_datetime"] >= df["tpep_pickup_datetime"])
-    ]
+    # Filter out invalid trips (distance and fare ranges are applied by TAXI_FILTERS on read)
+    df = df[df["tpep_dropoff_datetime"] >= df["tpep_pickup_datetime"]]
 
     # Calculate trip duration in minutes
-    df["trip_duration_minutes"] = (
-    (df["tpep_dropoff_datetime"] - df["tpep_pickup_datetime"])
-    .dt.total_seconds() / 60
-    )
+    pickup = df["tpep_pickup_datetime"].to_numpy()
+    dropoff = df["tpep_dropoff_datetime"].to_numpy()
+    df["trip_duration_minutes"] = (dropoff - pickup) / np.timedelta64(1, "m")
 
-    # Extract pickup hour
-    df["pickup_hour"] = df["tpep_pickup_datetime"].dt.hour
+    # Extract pickup hour as int8 to keep the column compact
+    df["pickup_hour"] = df["tpep_pickup_datetime"].dt.hour.astype("int8")
 
-    # Extract pickup day of week
-    df["pickup_day_of_week"] = df["tpep_pickup_datetime"].dt.day_name()
+    # Extract pickup day of week as an integer (Monday=0), labels are applied when plotting
+    df["pickup_dow"] = df["tpep_pickup_datetime"].dt.dayofweek.astype("int8")
 
     # Calculate trip speed in mph, handling cases where duration is zero
-    df["trip_speed_mph"] = 0.0
-    mask = df["trip_duration_minutes"] > 0
-    df.loc[mask, "trip_speed_mph"] = (
-        df.loc[mask, "trip_distance"] /
-        (df.loc[mask, "trip_duration_minutes"] / 60)
+    duration = df["trip_duration_minutes"].to_numpy()
+    distance = df["trip_distance"].to_numpy()
+    df["trip_speed_mph"] = np.divide(
+        distance * 60, duration,
+        out=np.zeros_like(duration), where=duration > 0
     )
     return df
 
+def save_clean_data(df, path):
+    # Store low-cardinality columns compactly so the cached file is small and fast to reload
+    df = df.astype({
+        "PULocationID": "int16",
+        "DOLocationID": "int16",
+        "payment_type": "int8"
+    })
+
+    # Tag the file with the cache version so files written by other code or older versions are rebuilt
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **table.schema.metadata,
+        b"clean_cache_version": CLEAN_CACHE_VERSION.encode()
+    })
+
+    # Write to a temporary file first so an interrupted write never leaves a partial cache
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    pq.write_table(table, tmp_path, compression="zstd", use_dictionary=True, row_group_size=250_000)
+    tmp_path.replace(path)
+    return df
+
+def read_clean_data(path):
+    # Only trust a cache written by this app with the current version, otherwise it gets rebuilt
+    if not path.exists():
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    if metadata.get(b"clean_cache_version") != CLEAN_CACHE_VERSION.encode():
+        return None
+    return pq.read_table(path).to_pandas(split_blocks=True, self_destruct=True)
+
 # Set Streamlit page configuration
 st.set_page_config(
     page_title="NYC Yellow Taxi Data Dashboard",
@@ -78,8 +148,8 @@ tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
     "Trips by Day of Week and Hour Heatmap"
 ])
 
-# Load Cleaned data with caching to optimize performance
-@st.cache_data
+# Load Cleaned data once and share it across sessions without copying, it is never modified after loading
+@st.cache_resource
 def load_data():
     taxi_url = "https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_2024-01.parquet"
     zone_url = "https://d37ci6vzurychx.cloudfront.net/misc/taxi_zone_lookup.csv"
@@ -87,23 +157,108 @@ def load_data():
     BASE_DIR = Path(__file__).resolve().parent.parent
     data_dir = BASE_DIR / "data" / "raw"
     data_dir.mkdir(parents=True, exist_ok=True)
+    clean_dir = BASE_DIR / "data" / "clean"
+    clean_dir.mkdir(parents=True, exist_ok=True)
 
     taxi_path = data_dir / "yellow_tripdata_2024-01.parquet"
     zone_path = data_dir / "taxi_zone_lookup.csv"
+    clean_path = clean_dir / "yellow_tripdata_2024-01_app_sample.parquet"
+
+    # Reuse the cleaned sample from a previous run if it is valid
+    df = read_clean_data(clean_path)
+
+    # The raw taxi data is only needed when there is no valid cleaned sample
+    urls, paths = [zone_url], [zone_path]
+    if df is None:
+        urls.append(taxi_url)
+        paths.append(taxi_path)
+
+    # Download the files concurrently so the small zone file does not wait on the taxi data
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        list(executor.map(download_file, urls, paths))
+
+    # Build the cleaned sample from the raw file when there is no valid cache
+    if df is None:
+        df = read_taxi_sample(taxi_path, n=100000)
+        df = clean_data(df)
+
+        # Sort by pickup time once so date filters can slice instead of scanning
+        df = df.sort_values("tpep_pickup_datetime", kind="mergesort", ignore_index=True)
+        df = save_clean_data(df, clean_path)
+    elif not df["tpep_pickup_datetime"].is_monotonic_increasing:
+        # The date filter slices with searchsorted, so a reloaded cache must be sorted by pickup time too
+        df = df.sort_values("tpep_pickup_datetime", kind="mergesort", ignore_index=True)
+
+    # Store payment labels as a categorical so filtering compares integer codes, unmapped types become missing
+    payment_codes = {payment_type: code for code, payment_type in enumerate(payment_labels)}
+    df["payment_type_label"] = pd.Categorical.from_codes(
+        df["payment_type"].map(payment_codes).fillna(-1).astype("int8"),
+        categories=list(payment_labels.values())
+    )
 
-    download_file(taxi_url, taxi_path)
-    download_file(zone_url, zone_path)
+    zones_df = pd.read_csv(zone_path)
 
-    df = pd.read_parquet(taxi_path)
+    # Zone names indexed by LocationID so charts can look them up without a merge
+    zone_lookup = np.full(max(zones_df["LocationID"].max(), df["PULocationID"].max()) + 1, None, dtype=object)
+    zone_lookup[zones_df["LocationID"].to_numpy()] = zones_df["Zone"].to_numpy()
+
+    return df, zone_lookup
+
+# Aggregate the filtered data for each chart, cached per filter selection.
+# The filtered DataFrame is not hashed (leading underscore), filter_key identifies it instead.
+# Each cache keeps at most 50 selections for an hour so a long-running deployment stays bounded.
+@st.cache_data(max_entries=50, ttl=3600)
+def agg_top_zones(_filtered_df, _zone_lookup, filter_key):
+    # Counting trips per pickup zone and selecting the top 10 without a full sort
+    counts = np.bincount(_filtered_df["PULocationID"].to_numpy(), minlength=10)
+    top_ids = np.argpartition(counts, -10)[-10:]
+    top_ids = top_ids[counts[top_ids] > 0]
+    top_zones = pd.DataFrame({
+        "PULocationID": top_ids,
+        "Count": counts[top_ids],
+        "Zone": _zone_lookup[top_ids]
+    })
 
-    df = df.sample(n=100000, random_state=42) 
+    # Sort by count for better visualization
+    return top_zones.sort_values("Count", ascending=True)
+
+@st.cache_data(max_entries=50, ttl=3600)
+def agg_hourly_fare(_filtered_df, filter_key):
+    # Average fare amount by pickup hour from per-hour fare sums and trip counts
+    hours = _filtered_df["pickup_hour"].to_numpy()
+    fare_sums = np.bincount(hours, weights=_filtered_df["fare_amount"].to_numpy(), minlength=24)
+    trip_counts = np.bincount(hours, minlength=24)
+
+    # Only keep hours that have trips
+    has_trips = trip_counts > 0
+    return pd.DataFrame({
+        "pickup_hour": np.arange(24)[has_trips],
+        "fare_amount": fare_sums[has_trips] / trip_counts[has_trips]
+    })
+
+@st.cache_data(max_entries=50, ttl=3600)
+def agg_trip_distances(_filtered_df, filter_key):
+    # Bin trip distances up to 20 miles on the server so only the bin counts are sent to the browser
+    counts, edges = np.histogram(_filtered_df["trip_distance"].to_numpy(), bins=50, range=(0, 20))
+    return pd.DataFrame({"trip_distance": (edges[:-1] + edges[1:]) / 2, "count": counts})
+
+@st.cache_data(max_entries=50, ttl=3600)
+def agg_payment_counts(_filtered_df, filter_key):
+    # Count trips by payment type
+    payment_counts = _filtered_df["payment_type"].value_counts().reset_index()
+    payment_counts.columns = ["payment_type", "count"]
 
-    df = clean_data(df)
-    zones_df = pd.read_csv(zone_path)
+    # Replace numeric codes with labels for plotting
+    payment_counts["payment_type"] = payment_counts["payment_type"].map(payment_labels)
+    return payment_counts
 
-    return df, zones_df
+@st.cache_data(max_entries=50, ttl=3600)
+def agg_heatmap(_filtered_df, filter_key):
+    # Count trips for each combination of pickup day of week and hour in a 7x24 grid
+    cells = _filtered_df["pickup_dow"].to_numpy(dtype=np.intp) * 24 + _filtered_df["pickup_hour"].to_numpy()
+    return np.bincount(cells, minlength=7 * 24).reshape(7, 24)
 
-df, zones_df = load_data()
+df, zone_lookup = load_data()
 
 # Display key metrics 
 with tab1:
@@ -117,15 +272,6 @@ with tab1:
 # Add sidebar filters
 st.sidebar.header("Filters")
 
-payment_labels = {
-    1: "Credit Card",
-    2: "Cash",
-    3: "No Charge",
-    4: "Dispute",
-    0: "Unknown"
-}
-df["payment_type_label"] = df["payment_type"].map(payment_labels)
-
 min_date = df["tpep_pickup_datetime"].min().date()
 max_date = df["tpep_pickup_datetime"].max().date()
 date_range = st.sidebar.date_input("Select Date Range", [min_date, max_date], min_value=min_date, max_value=max_date)
@@ -138,35 +284,35 @@ payment_types = st.sidebar.multiselect(
     default=list(payment_labels.values())
 )
 
-# Apply filters to the DataFrame
-filtered_df = df[
-    (df["tpep_pickup_datetime"] >= pd.to_datetime(date_range[0])) &
-    (df["tpep_pickup_datetime"] <= pd.to_datetime(date_range[1])) &
-    (df["pickup_hour"] >= hour_range[0]) &
-    (df["pickup_hour"] <= hour_range[1]) &
-    (df["payment_type_label"].isin(payment_types))
-]
+# Convert the selected dates to the pickup time dtype once, the end date is inclusive
+pickup_times = df["tpep_pickup_datetime"].to_numpy()
+date_bounds = np.array([
+    np.datetime64(date_range[0]),
+    np.datetime64(date_range[1]) + np.timedelta64(1, "D")
+]).astype(pickup_times.dtype)
 
-with tab2:
-    # Counting top 10 pickup zones
-    top_zones = (
-        filtered_df["PULocationID"]
-        .value_counts()
-        .head(10)
-        .reset_index()
-    )
-    top_zones.columns = ["PULocationID", "Count"]
-
-    # Merge with zones to get zone names
-    top_zones = top_zones.merge(
-        zones_df[["LocationID", "Zone"]],
-        left_on="PULocationID",
-        right_on="LocationID",
-        how="left"
-    )
+# Apply the date filter as a slice, the data is sorted by pickup time
+start, end = pickup_times.searchsorted(date_bounds)
+date_df = df.iloc[start:end]
 
-    # Sort by count for better visualization
-    top_zones = top_zones.sort_values("Count", ascending=True)
+# Build lookup tables of the selected hours and payment codes
+hour_allowed = np.zeros(24, dtype=bool)
+hour_allowed[hour_range[0]:hour_range[1] + 1] = True
+
+# The extra last entry stays False so unmapped payment types (code -1) are excluded
+payment_allowed = np.zeros(len(payment_labels) + 1, dtype=bool)
+payment_allowed[df["payment_type_label"].cat.categories.get_indexer(payment_types)] = True
+
+# Apply the remaining filters to the DataFrame with a single mask
+mask = hour_allowed[date_df["pickup_hour"].to_numpy()]
+mask &= payment_allowed[date_df["payment_type_label"].cat.codes.to_numpy()]
+filtered_df = date_df[mask]
+
+# Hashable key of the current filter selection for the cached aggregates
+filter_key = (tuple(date_range), hour_range, tuple(payment_types))
+
+with tab2:
+    top_zones = agg_top_zones(filtered_df, zone_lookup, filter_key)
 
     # Create Horizontal Bar Chart for top pickup zones with visual enhancements
     fig1 = px.bar(
@@ -200,24 +346,15 @@ with tab2:
     """)
 
 with tab3:
-    # Groups average fare amount by pickup hour
-    hourly_fare = (
-        filtered_df.groupby("pickup_hour")["fare_amount"]
-        .mean()
-        .reset_index()
-    )
+    hourly_fare = agg_hourly_fare(filtered_df, filter_key)
 
     # Create Line chart for average fare by hour of day
-    fig2 = px.line(
-        hourly_fare,
-        x="pickup_hour",
-        y="fare_amount",
-        markers=True,
-        labels={
-            "pickup_hour": "Hour of Day",
-            "fare_amount": "Average Fare ($)"
-        }
-    )
+    fig2 = go.Figure(go.Scatter(
+        x=hourly_fare["pickup_hour"],
+        y=hourly_fare["fare_amount"],
+        mode="lines+markers",
+        hovertemplate="Hour of Day: %{x}<br>Average Fare ($): %{y}<extra></extra>"
+    ))
 
     # Formatting x and y axes
     fig2.update_xaxes(
@@ -244,29 +381,23 @@ with tab3:
     """)
 
 with tab4:
-    # Filter out trips with unrealistic distances for better visualization
-    hist_filtered = filtered_df[
-    (filtered_df['trip_distance'] > 0) & (filtered_df['trip_distance'] < 20)
-    ]
-
-    # Create histogram for trip distance distribution
-    fig3 = px.histogram(
-        hist_filtered,
-        x="trip_distance",
-        nbins=50,
-        title="Distribution of Trip Distances",
-        labels={"trip_distance": "Trip Distance (miles)", "count": "Number of Trips"},
-        template="plotly_white",
-        color_discrete_sequence=["green"],
-        opacity=0.8,
-        hover_data={"trip_distance": True}
-    )
+    # Trip distances pre-binned into 50 bins, excluding unrealistic distances over 20 miles
+    distance_bins = agg_trip_distances(filtered_df, filter_key)
+
+    # Create histogram for trip distance distribution from the binned counts
+    fig3 = go.Figure(go.Bar(
+        x=distance_bins["trip_distance"],
+        y=distance_bins["count"],
+        marker_color="green",
+        opacity=0.8
+    ))
 
     # Histogram formatting
     fig3.update_traces(marker_line_width=0.5, marker_line_color="white", hovertemplate='Trip Distance: %{x}<br>Count: %{y}<extra></extra>')
 
     fig3.update_layout(
         title=dict(text="Distribution of Trip Distances (Trips ≤ 20 miles)", x=0.5, font=dict(size=20)),
+        template="plotly_white",
         xaxis=dict(range=[0, 20], title="Trip Distance (miles)", tick0=0, dtick=2),
         yaxis=dict(title="Number of Trips", showgrid=True),
         font=dict(family="Arial", size=12),
@@ -283,12 +414,7 @@ with tab4:
 with tab5:
     color_sequence = ["#2ca02c", "#1f77b4", "#ff7f0e", "#d62728", "#7f7f7f"]
 
-    # Count trips by payment type
-    payment_counts = filtered_df["payment_type"].value_counts().reset_index()
-    payment_counts.columns = ["payment_type", "count"]
-
-    # Replace numeric codes with labels for plotting
-    payment_counts["payment_type"] = payment_counts["payment_type"].map(payment_labels)
+    payment_counts = agg_payment_counts(filtered_df, filter_key)
 
     # Create pie chart
     fig4 = px.pie(
@@ -321,53 +447,39 @@ with tab5:
     """)
 
 with tab6:
-    # Create heatmap data by counting trips for each combination of pickup day of week and hour
-    heatmap_data = (
-        filtered_df.groupby(["pickup_day_of_week", "pickup_hour"])
-        .size()
-        .reset_index(name="trip_count")
-    )
-
-    # Define weekday order for consistent plotting
-    weekday_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    # Trip counts in a 7x24 grid, rows are days of the week and columns are hours
+    trip_counts = agg_heatmap(filtered_df, filter_key)
 
     # Create heatmap for trips by day of week and hour
-    fig5 = px.density_heatmap(
-        heatmap_data,
-        x="pickup_hour",
-        y="pickup_day_of_week",
-        z="trip_count",
-        category_orders={"pickup_day_of_week": weekday_order},
-        title="Trips by Day of Week and Hour",
-        labels={
-            "pickup_hour": "Hour of Day",
-            "pickup_day_of_week": "Day of Week",
-            "trip_count": "Number of Trips"
-        },
-        template="plotly_white"
-    )
+    fig5 = go.Figure(go.Heatmap(
+        z=trip_counts,
+        x=np.arange(24),
+        y=WEEKDAY_ORDER,
+        coloraxis="coloraxis",
+        hovertemplate="Hour of Day: %{x}<br>Day of Week: %{y}<br>Number of Trips: %{z}<extra></extra>"
+    ))
 
     # Formatting heatmap
-    fig5.update_traces(
-        zmin=0,
-        zmax=heatmap_data["trip_count"].max()
-    )
-
-    fig5.update_yaxes(categoryorder="array", categoryarray=weekday_order[::-1])
-    fig5.update_xaxes(tick0=0, dtick=1)
+    fig5.update_yaxes(categoryorder="array", categoryarray=WEEKDAY_ORDER[::-1], title="Day of Week")
+    fig5.update_xaxes(tick0=0, dtick=1, title="Hour of Day")
 
     fig5.update_layout(
         title=dict(text="Trips by Day of Week and Hour", x=0.5, font=dict(size=20)),
+        template="plotly_white",
         font=dict(family="Arial", size=12),
         width=1000,
         height=600,
         margin=dict(l=80, r=80, t=100, b=80),
-        coloraxis_colorbar=dict(
-            title="Number of Trips",
-            tickformat=",",
-            thickness=15,
-            lenmode="fraction",
-            len=0.75
+        coloraxis=dict(
+            cmin=0,
+            cmax=trip_counts.max(),
+            colorbar=dict(
+                title="Number of Trips",
+                tickformat=",",
+                thickness=15,
+                lenmode="fraction",
+                len=0.75
+            )
         )
     )
     st.plotly_chart(fig5, use_container_width=True)